@@ -16,15 +16,123 @@ Message Types:
 import sys
 import json
 import os
+import queue
+import itertools
+import threading
 from typing import List, Dict, Any, Callable, Optional
 import traceback
 
+# orjson parses and serializes several times faster than stdlib json;
+# fall back to json so the worker still runs without it installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Keep the LM response cache on disk across worker invocations, so
+# re-running with tweaked metrics or datasets skips already-seen
+# prompts. Set before the dspy import below, which is when DSPy picks
+# up its cache directory.
+os.environ.setdefault(
+    'DSPY_CACHEDIR',
+    os.path.expanduser(os.path.join('~', '.cache', 'dspy-ide'))
+)
+
+# Import DSPy once at module load instead of inside every function; the
+# repeated per-call imports showed up inside the optimizer inner loops.
+# A missing install is reported from main() so the error still reaches
+# Node.js as a JSON message rather than a bare traceback.
+try:
+    import dspy
+    from dspy.teleprompt import MIPROv2
+    from dspy.evaluate import Evaluate
+except ImportError:
+    dspy = None
+
+# SemanticF1 is missing from some DSPy versions; probe once here so the
+# fallback branch in create_metric doesn't pay a failed sys.path walk
+# every time the metric is constructed
+try:
+    from dspy.evaluate import SemanticF1 as _SemanticF1
+except ImportError:
+    _SemanticF1 = None
+
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def _loads(data) -> Any:
+    """Parse JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _write_message(obj: Dict[str, Any]):
+    """Write one line-delimited JSON message to stdout"""
+    sys.stdout.buffer.write(_dumps(obj) + b'\n')
+    sys.stdout.buffer.flush()
+
+
+# Progress messages go through a background writer thread that coalesces
+# consecutive lines into a single os.write, so each DSPy callback pays a
+# queue put instead of a write+flush syscall pair. Framing stays
+# line-delimited JSON, which the Node.js side parses unchanged.
+_log_queue: "queue.Queue" = queue.Queue()
+_writer_lock = threading.Lock()
+_writer_started = False
+
+
+def _writer_loop():
+    while True:
+        batch = [_log_queue.get()]
+        # Drain whatever else is already queued into the same write
+        while len(batch) < 64:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        data = b''.join(batch)
+        try:
+            # os.write may write fewer bytes than asked; loop so a short
+            # write can't emit a torn JSON line
+            while data:
+                data = data[os.write(1, data):]
+        except OSError:
+            # stdout is gone (parent closed the pipe or crashed): nothing
+            # we emit can be seen, and dying here would leave the queue's
+            # join() blocking forever - stop the orphaned run outright
+            os._exit(1)
+        for _ in batch:
+            _log_queue.task_done()
+
+
+def _enqueue_message(obj: Dict[str, Any]):
+    global _writer_started
+    if not _writer_started:
+        with _writer_lock:
+            if not _writer_started:
+                threading.Thread(target=_writer_loop, daemon=True).start()
+                _writer_started = True
+    _log_queue.put(_dumps(obj) + b'\n')
+
+
+def _flush_messages():
+    """Block until every queued progress message has reached stdout"""
+    if _writer_started:
+        _log_queue.join()
+
+
 def log_progress(message: str, data: Optional[Dict] = None):
     """Send progress message to Node.js"""
     progress = {'type': 'progress', 'message': message}
     if data:
         progress['data'] = data
-    print(json.dumps(progress), flush=True)
+    _enqueue_message(progress)
 
 
 def log_error(message: str, tb: Optional[str] = None):
@@ -32,7 +140,10 @@ def log_error(message: str, tb: Optional[str] = None):
     error = {'type': 'error', 'message': message}
     if tb:
         error['traceback'] = tb
-    print(json.dumps(error), flush=True)
+    # Errors precede exit: flush queued progress first to keep ordering,
+    # then write synchronously
+    _flush_messages()
+    _write_message(error)
 
 
 # ============================================================================
@@ -54,20 +165,38 @@ def setup_language_model(config: Dict[str, Any]):
     Returns:
         Configured DSPy LM instance
     """
-    import dspy
-
     provider = config.get('provider', 'ollama')
     model_id = config.get('model', 'llama3.2:1b')
     api_key = config.get('api_key', '')
     api_base = config.get('api_base')
 
+    # Cache LM responses so repeated prompts (MIPROv2 re-ranks the same
+    # candidates across trials) skip the HTTP round-trip entirely
+    use_cache = config.get('cache', True)
+
+    # Optional per-run override of the persistent cache location; the
+    # default is set via DSPY_CACHEDIR before the dspy import, which is
+    # the only point the env var is read, so repoint the disk cache
+    # through the runtime API instead
+    cache_dir = config.get('cache_dir')
+    if cache_dir:
+        cache_dir = os.path.expanduser(cache_dir)
+        if hasattr(dspy, 'configure_cache'):
+            dspy.configure_cache(enable_disk_cache=True, disk_cache_dir=cache_dir)
+        else:
+            log_progress(
+                f"cache_dir override not supported by this DSPy version; "
+                f"using {os.environ['DSPY_CACHEDIR']}"
+            )
+
     if provider == 'ollama':
         # Ollama local models
         base_url = api_base or 'http://localhost:11434'
         lm = dspy.LM(
             model=f'ollama_chat/{model_id}',
             api_base=base_url,
-            api_key=''
+            api_key='',
+            cache=use_cache
         )
 
     elif provider == 'openai':
@@ -78,7 +207,8 @@ def setup_language_model(config: Dict[str, Any]):
 
         lm = dspy.LM(
             model=f'openai/{model_id}',
-            api_key=api_key
+            api_key=api_key,
+            cache=use_cache
         )
 
     elif provider == 'anthropic':
@@ -88,7 +218,8 @@ def setup_language_model(config: Dict[str, Any]):
 
         lm = dspy.LM(
             model=f'anthropic/{model_id}',
-            api_key=api_key
+            api_key=api_key,
+            cache=use_cache
         )
 
     else:
@@ -104,6 +235,11 @@ def setup_language_model(config: Dict[str, Any]):
 # DATASET PREPARATION
 # ============================================================================
 
+# Input-field marker shared by every Example; with_inputs() would copy
+# the Example and build a fresh key set for each one
+_INPUT_KEYS = frozenset(('question',))
+
+
 def prepare_dataset(dataset_raw: List[Dict[str, Any]], dataset_name: str = "dataset") -> List:
     """
     Convert raw dataset to DSPy Examples
@@ -115,25 +251,59 @@ def prepare_dataset(dataset_raw: List[Dict[str, Any]], dataset_name: str = "data
     Returns:
         List of dspy.Example objects
     """
-    import dspy
-
-    if not dataset_raw or len(dataset_raw) == 0:
+    if not dataset_raw:
         raise ValueError(f"{dataset_name} is empty")
 
-    examples = []
-
-    for i, item in enumerate(dataset_raw):
-        if 'input' not in item or 'output' not in item:
-            raise ValueError(f"{dataset_name}[{i}] missing 'input' or 'output' field")
+    # Validate up front in one pass so construction below can run as a
+    # bare comprehension without per-item branching
+    missing = [
+        i for i, item in enumerate(dataset_raw)
+        if 'input' not in item or 'output' not in item
+    ]
+    if missing:
+        raise ValueError(f"{dataset_name}[{missing[0]}] missing 'input' or 'output' field")
+
+    # JSON-decoded datasets normally hold str values already; skip the
+    # per-item str() casts when the whole dataset does (the all() scan
+    # is a cheap C-level pass)
+    all_str = all(
+        type(item['input']) is str and type(item['output']) is str
+        for item in dataset_raw
+    )
 
-        # Create DSPy Example with question -> answer signature
-        # .with_inputs() marks which fields are inputs (vs outputs)
-        example = dspy.Example(
-            question=str(item['input']),
-            answer=str(item['output'])
-        ).with_inputs('question')
+    # Create DSPy Examples with question -> answer signature
+    if all_str:
+        examples = [
+            dspy.Example(question=item['input'], answer=item['output'])
+            for item in dataset_raw
+        ]
+    else:
+        examples = [
+            dspy.Example(question=str(item['input']), answer=str(item['output']))
+            for item in dataset_raw
+        ]
+
+    # Mark 'question' as the input field. Assigning Example's internal
+    # _input_keys shares one frozenset across all examples and skips the
+    # per-example copy inside with_inputs(); verify on the first example
+    # and fall back to with_inputs() if DSPy's internals ever change.
+    try:
+        examples[0]._input_keys = _INPUT_KEYS
+        fast_input_keys = set(examples[0].inputs().keys()) == {'question'}
+    except Exception:
+        fast_input_keys = False
+
+    if fast_input_keys:
+        for example in examples[1:]:
+            example._input_keys = _INPUT_KEYS
+    else:
+        examples = [example.with_inputs('question') for example in examples]
 
-        examples.append(example)
+    # Precompute normalized answers once; the metrics read these on
+    # every evaluator call instead of re-normalizing the same string
+    for example in examples:
+        example._answer_norm_cs = example.answer.strip()
+        example._answer_norm_ci = example._answer_norm_cs.lower()
 
     return examples
 
@@ -148,14 +318,13 @@ def create_metric(metric_config: Dict[str, Any]) -> Callable:
 
     Args:
         metric_config: {
-            'type': 'exact_match' | 'semantic_f1' | 'contains'
+            'type': 'exact_match' | 'semantic_f1' | 'contains' | 'custom',
+            'custom_code': 'def metric_function(example, pred, trace=None): ...'
         }
 
     Returns:
         Metric function: (example, prediction, trace) -> float/bool
     """
-    import dspy
-
     metric_type = metric_config.get('type', 'exact_match')
 
     if metric_type == 'exact_match':
@@ -165,7 +334,11 @@ def create_metric(metric_config: Dict[str, Any]) -> Callable:
             if not hasattr(pred, 'answer'):
                 return False
 
-            expected = str(example.answer).strip().lower()
+            # Use the normalized answer precomputed in prepare_dataset;
+            # fall back to normalizing for examples built elsewhere
+            expected = getattr(example, '_answer_norm_ci', None)
+            if expected is None:
+                expected = str(example.answer).strip().lower()
             predicted = str(pred.answer).strip().lower()
 
             return expected == predicted
@@ -179,25 +352,45 @@ def create_metric(metric_config: Dict[str, Any]) -> Callable:
             if not hasattr(pred, 'answer'):
                 return False
 
-            expected = str(example.answer).strip().lower()
+            expected = getattr(example, '_answer_norm_ci', None)
+            if expected is None:
+                expected = str(example.answer).strip().lower()
             predicted = str(pred.answer).strip().lower()
 
             return expected in predicted
 
         return contains_metric
 
+    elif metric_type == 'custom':
+        # User-supplied metric code defining metric_function(example, pred, trace)
+        custom_code = metric_config.get('custom_code', '')
+        if not custom_code:
+            raise ValueError("Custom metric requires 'custom_code' in metric_config")
+
+        # Compile and exec exactly once here; the resulting function is then
+        # invoked thousands of times inside the evaluator with no further
+        # compilation or module-level re-execution
+        code_obj = compile(custom_code, '<custom_metric>', 'exec')
+        namespace = {'dspy': dspy}
+        exec(code_obj, namespace)
+
+        metric_function = namespace.get('metric_function')
+        if not callable(metric_function):
+            raise ValueError("Custom metric code must define a 'metric_function' callable")
+
+        return metric_function
+
     elif metric_type == 'semantic_f1':
-        # Use DSPy's built-in SemanticF1 metric
+        # Use DSPy's built-in SemanticF1 metric (probed once at import)
         # This compares semantic similarity using embeddings
-        try:
-            from dspy.evaluate import SemanticF1
-            return SemanticF1()
-        except ImportError:
+        if _SemanticF1 is None:
             log_progress("SemanticF1 not available, falling back to exact match")
             return create_metric({'type': 'exact_match'})
 
+        return _SemanticF1()
+
     else:
-        raise ValueError(f"Unknown metric type: {metric_type}. Use 'exact_match', 'contains', or 'semantic_f1'.")
+        raise ValueError(f"Unknown metric type: {metric_type}. Use 'exact_match', 'contains', 'semantic_f1', or 'custom'.")
 
 
 # ============================================================================
@@ -215,8 +408,6 @@ def create_dspy_program(program_type: str = 'predict', initial_instruction: str
     Returns:
         DSPy Module instance
     """
-    import dspy
-
     # Create signature with initial instruction if provided
     if initial_instruction:
         # Create a signature with instructions parameter
@@ -294,9 +485,6 @@ def run_mipro(
     Returns:
         Compiled DSPy program
     """
-    import dspy
-    from dspy.teleprompt import MIPROv2
-
     log_progress("Starting MIPROv2 optimization")
 
     mode = config.get('mode', 'light')
@@ -305,6 +493,7 @@ def run_mipro(
     minibatch = config.get('minibatch', True)
     minibatch_size = config.get('minibatch_size', 35)
     metric_threshold = config.get('metric_threshold')
+    num_threads = config.get('num_threads')
 
     log_progress(f"Optimizing with mode={mode}")
 
@@ -325,6 +514,10 @@ def run_mipro(
     if metric_threshold is not None:
         optimizer_kwargs['metric_threshold'] = metric_threshold
 
+    if num_threads is not None:
+        # Parallelize trial evaluations inside the compile loop
+        optimizer_kwargs['num_threads'] = num_threads
+
     optimizer = MIPROv2(**optimizer_kwargs)
 
     # Compile the program
@@ -351,7 +544,7 @@ def evaluate_program(
     program: Any,
     devset: List,
     metric: Callable,
-    num_threads: int = 1
+    num_threads: Optional[int] = None
 ) -> float:
     """
     Evaluate compiled program on dev set
@@ -361,14 +554,16 @@ def evaluate_program(
         devset: Evaluation examples
         metric: Evaluation metric
         num_threads: Number of threads for parallel evaluation
+                     (defaults to min(32, len(devset)) - LM calls are
+                     network-bound so threads overlap request latency)
 
     Returns:
         Average metric score
     """
-    import dspy
-    from dspy.evaluate import Evaluate
+    if num_threads is None:
+        num_threads = min(32, max(1, len(devset)))
 
-    log_progress(f"Evaluating on {len(devset)} examples...")
+    log_progress(f"Evaluating on {len(devset)} examples ({num_threads} threads)...")
 
     evaluator = Evaluate(
         devset=devset,
@@ -400,6 +595,18 @@ def evaluate_program(
 # RESULT EXTRACTION
 # ============================================================================
 
+# Cap per-demo field length; the whole payload is JSON-dumped to stdout
+# and re-parsed on the Node.js side
+_DEMO_TEXT_LIMIT = 2000
+
+
+def _demo_text(value: Any) -> str:
+    """Coerce a demo field to a display string, truncated for transport"""
+    if not isinstance(value, str):
+        value = str(value)
+    return value[:_DEMO_TEXT_LIMIT]
+
+
 def extract_optimized_results(compiled_program: Any) -> Dict[str, Any]:
     """
     Extract optimized signature, instructions, and demos from compiled program
@@ -410,8 +617,6 @@ def extract_optimized_results(compiled_program: Any) -> Dict[str, Any]:
     Returns:
         Dictionary with optimized components
     """
-    import dspy
-
     results = {
         'instructions': {},
         'demos': [],
@@ -435,13 +640,18 @@ def extract_optimized_results(compiled_program: Any) -> Dict[str, Any]:
                 'type': type(module).__name__
             }
 
+            # Probe optional attributes once per predictor instead of
+            # paired hasattr/access lookups in each method below
+            signature = getattr(module, 'signature', None)
+            demos = getattr(module, 'demos', None)
+
             # Method 1: Use adapter to get the full formatted prompt (recommended by DSPy team)
-            if adapter and hasattr(module, 'signature'):
+            if adapter and signature is not None:
                 try:
                     formatted = adapter.format(
-                        module.signature,
-                        demos=getattr(module, 'demos', []),
-                        inputs={k: f"{{{k}}}" for k in module.signature.input_fields},
+                        signature,
+                        demos=demos or [],
+                        inputs={k: f"{{{k}}}" for k in signature.input_fields},
                     )
                     if formatted:
                         # The formatted prompt contains the full optimized instruction
@@ -452,18 +662,14 @@ def extract_optimized_results(compiled_program: Any) -> Dict[str, Any]:
             instruction = None
 
             # Method 2: Check signature.instructions (DSPy 3.x stores it here)
-            if hasattr(module, 'signature'):
-                sig = module.signature
-                if hasattr(sig, 'instructions') and sig.instructions:
-                    instruction = sig.instructions
-                elif hasattr(sig, '__doc__') and sig.__doc__:
-                    instruction = sig.__doc__
+            if signature is not None:
+                instruction = getattr(signature, 'instructions', None) or signature.__doc__
 
             # Method 3: Check extended_signature (older DSPy versions)
-            if not instruction and hasattr(module, 'extended_signature'):
-                sig = module.extended_signature
-                if hasattr(sig, 'instructions') and sig.instructions:
-                    instruction = sig.instructions
+            if not instruction:
+                ext_sig = getattr(module, 'extended_signature', None)
+                if ext_sig is not None:
+                    instruction = getattr(ext_sig, 'instructions', None)
 
             if instruction:
                 # Clean up the instruction text
@@ -473,18 +679,19 @@ def extract_optimized_results(compiled_program: Any) -> Dict[str, Any]:
                     predictor_info['instruction'] = instruction
 
             # Extract demonstrations if available
-            if hasattr(module, 'demos') and module.demos:
-                demo_count = len(module.demos)
-                predictor_info['demo_count'] = demo_count
+            if demos:
+                predictor_info['demo_count'] = len(demos)
 
-                # Extract up to 10 demos for display
-                for i, demo in enumerate(module.demos[:10]):
-                    demo_dict = {
+                # Stream up to 10 demos for display straight into the
+                # results list, without an intermediate copy of the slice
+                results['demos'].extend(
+                    {
                         'predictor': name,
-                        'input': str(demo.question) if hasattr(demo, 'question') else '',
-                        'output': str(demo.answer) if hasattr(demo, 'answer') else ''
+                        'input': _demo_text(getattr(demo, 'question', '')),
+                        'output': _demo_text(getattr(demo, 'answer', ''))
                     }
-                    results['demos'].append(demo_dict)
+                    for demo in itertools.islice(demos, 10)
+                )
 
             results['predictors'].append(predictor_info)
 
@@ -498,7 +705,6 @@ def extract_optimized_results(compiled_program: Any) -> Dict[str, Any]:
 
     except Exception as e:
         log_progress(f"Warning: Could not fully extract results: {str(e)}")
-        import traceback
         log_progress(f"Traceback: {traceback.format_exc()}")
 
     return results
@@ -519,8 +725,6 @@ def save_compiled_program(compiled_program: Any, save_path: str) -> str:
     Returns:
         Absolute path where program was saved
     """
-    import os
-
     try:
         # Create directory if it doesn't exist
         os.makedirs(save_path, exist_ok=True)
@@ -544,17 +748,17 @@ def main():
 
     try:
         # Step 1: Read configuration from stdin
-        config_json = sys.stdin.read()
+        # Read raw bytes and let the JSON parser decode, skipping the
+        # text-mode decode pass over potentially large embedded datasets
+        config_json = sys.stdin.buffer.read()
 
         if not config_json or not config_json.strip():
             raise ValueError("No configuration received on stdin")
 
-        config = json.loads(config_json)
+        config = _loads(config_json)
 
-        # Step 2: Import DSPy (check if installed)
-        try:
-            import dspy
-        except ImportError as e:
+        # Step 2: Check DSPy availability (import happened at module load)
+        if dspy is None:
             raise ImportError(
                 "DSPy library not found. Please install it with: pip install dspy-ai"
             )
@@ -570,11 +774,27 @@ def main():
         if 'val_dataset' in config and config['val_dataset']:
             valset = prepare_dataset(config['val_dataset'], 'val_dataset')
         else:
-            # Auto-split: 80% train, 20% val
-            split_idx = int(len(trainset) * 0.8)
-            if split_idx < len(trainset):
+            # Auto-split: 80% train, 20% val by default
+            n = len(trainset)
+            val_count = config.get('val_split_count')
+            if val_count is not None:
+                # Absolute number of validation examples
+                split_idx = max(n - int(val_count), 0)
+            else:
+                # Ratio is the fraction of examples kept for training
+                ratio = config.get('val_split_ratio', 0.8)
+                if ratio == 0.8:
+                    # Default path in pure integer arithmetic
+                    split_idx = (n * 4) // 5
+                else:
+                    split_idx = int(n * ratio)
+
+            if 0 < split_idx < n:
                 valset = trainset[split_idx:]
-                trainset = trainset[:split_idx]
+                # Truncate in place rather than copying the train slice;
+                # keeps the existing backing list and skips a second
+                # allocation for large datasets
+                del trainset[split_idx:]
                 log_progress(f"Using {len(trainset)} training examples, {len(valset)} validation examples")
             else:
                 # Dataset too small, use all for train and val
@@ -601,7 +821,11 @@ def main():
             raise ValueError(f"Unknown optimizer: {optimizer_type}. Use 'MIPROv2' for instruction optimization.")
 
         # Step 8: Evaluate compiled program
-        validation_score = evaluate_program(compiled_program, valset, metric)
+        # Threads default to min(32, len(valset)); overridable via config
+        eval_threads = config.get('eval_threads', optimizer_config.get('num_threads'))
+        validation_score = evaluate_program(
+            compiled_program, valset, metric, num_threads=eval_threads
+        )
 
         # Step 9: Extract results
         extracted_results = extract_optimized_results(compiled_program)
@@ -628,8 +852,13 @@ def main():
             'program_type': program_type
         }
 
-        print(json.dumps(success_result), flush=True)
-        sys.exit(0)
+        _flush_messages()
+        _write_message(success_result)
+
+        # _write_message already flushed the payload; os._exit skips the
+        # atexit/GC teardown of the compiled program graph (demos, LM
+        # caches) that nothing reads past this point
+        os._exit(0)
 
     except Exception as e:
         # Catch all exceptions and return error